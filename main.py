@@ -1,11 +1,28 @@
+import argparse
+import cProfile
+import hashlib
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
 import cv2
 import numpy as np
-import os
 
 # ========== НАСТРОЙКИ ==========
 window_name = "Ellipse Detection"
 default_image = "IMG_cup.jpg"  # Убедитесь, что файл существует
 output_dir = "results"  # Папка для сохранения результатов
+profile_frames = 100  # Сколько кадров профилировать по клавише 'p'
+gate_size = (32, 24)  # Размер уменьшенного кадра для проверки изменений
+display_scale = 1.0  # Масштаб изображений в окне (0.5 - вдвое меньше)
+display_fps = 30  # Максимальная частота обновления окна
+batch_size = 64  # Изображений в одной мозаике пакетного режима
+batch_max_overhead = 1.5  # Предел площади плитки с промежутком к площади изображения
+batch_max_pixels = 112 * 84  # Больше этой площади мозаика не быстрее обработки по одному
 # ===============================
 
 # Создаем папку для результатов
@@ -29,9 +46,43 @@ params = {
     'aspect_ratio': 0.7,
     'angle_tolerance': 45,
     'dilate_iter': 2,
-    'pre_blur': 5
+    'pre_blur': 5,
+    'prefilter': 0,
+    'cc_min_pixels': 0,
+    'cc_min_aspect': 0,
+    'cc_min_fill': 0,
+    'change_threshold': 2
+}
+
+# Состояние профилировщика
+profiler = {
+    'active': False,
+    'frames_left': 0,
+    'frames': 0,
+    'cprofile': None,
+    'snapshot': None,
+    'stages': {}
+}
+
+# Холст мозаики 2x2: последние изображения четвертей и уже нарисованные
+compositor = {
+    'canvas': None,
+    'gray': None,
+    'sources': [None] * 4,
+    'drawn': [None] * 4,
+    'last_show': 0.0
+}
+
+# Записываемая сессия настройки параметров
+session = {
+    'image': None,
+    'start': None,
+    'steps': []
 }
 
+# Последние обработанные кадры по потокам для пропуска неизменных сцен
+change_gate = {}
+
 
 def initialize_trackbars():
     """Инициализация трекбаров после создания окна"""
@@ -43,6 +94,12 @@ def initialize_trackbars():
     cv2.createTrackbar('Angle Tol.', window_name, 45, 90, lambda x: None)
     cv2.createTrackbar('Dilate Iter', window_name, 2, 5, lambda x: None)
     cv2.createTrackbar('Pre Blur', window_name, 5, 15, lambda x: None)
+    cv2.createTrackbar('CC Prefilter', window_name, 0, 1, lambda x: None)
+    # Отбор компонент с потерями: компонента отбрасывается вместе с дырами (0 - выключен)
+    cv2.createTrackbar('CC Min Pixels', window_name, 0, 200, lambda x: None)
+    cv2.createTrackbar('CC Aspect', window_name, 0, 100, lambda x: None)
+    cv2.createTrackbar('CC Fill', window_name, 0, 100, lambda x: None)
+    cv2.createTrackbar('Change Thr.', window_name, 2, 20, lambda x: None)
 
 
 def update_parameters():
@@ -56,19 +113,156 @@ def update_parameters():
             'aspect_ratio': cv2.getTrackbarPos('Aspect Ratio', window_name) / 100,
             'angle_tolerance': cv2.getTrackbarPos('Angle Tol.', window_name),
             'dilate_iter': cv2.getTrackbarPos('Dilate Iter', window_name),
-            'pre_blur': cv2.getTrackbarPos('Pre Blur', window_name) | 1
+            'pre_blur': cv2.getTrackbarPos('Pre Blur', window_name) | 1,
+            'prefilter': cv2.getTrackbarPos('CC Prefilter', window_name),
+            'cc_min_pixels': cv2.getTrackbarPos('CC Min Pixels', window_name),
+            'cc_min_aspect': cv2.getTrackbarPos('CC Aspect', window_name) / 100,
+            'cc_min_fill': cv2.getTrackbarPos('CC Fill', window_name) / 100,
+            'change_threshold': cv2.getTrackbarPos('Change Thr.', window_name)
         })
     except cv2.error:
         pass
 
 
-def process_image():
+@contextmanager
+def stage(name):
+    """Учёт времени и памяти этапа обработки во время профилирования"""
+    if not profiler['active']:
+        yield
+        return
+
+    mem_before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
     try:
-        # 1. Подготовка изображения
-        blurred = cv2.GaussianBlur(global_vars['gray'],
-                                   (params['pre_blur'], params['pre_blur']), 0)
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        allocated = tracemalloc.get_traced_memory()[0] - mem_before
+        total_time, total_mem, calls = profiler['stages'].get(name, (0.0, 0, 0))
+        profiler['stages'][name] = (total_time + elapsed, total_mem + allocated, calls + 1)
+
+
+def start_profiling(frames):
+    """Запуск сбора cProfile и tracemalloc на заданное число кадров"""
+    if profiler['active']:
+        return
+
+    tracemalloc.start()
+    profiler.update({
+        'active': True,
+        'frames_left': max(1, frames),
+        'frames': 0,
+        'cprofile': cProfile.Profile(),
+        'snapshot': tracemalloc.take_snapshot(),
+        'stages': {}
+    })
+    print(f"Профилирование запущено на {profiler['frames_left']} кадров")
+
+
+def profile_frame(func):
+    """Выполнение одного кадра под профилировщиком"""
+    if not profiler['active']:
+        func()
+        return
 
-        # 2. Адаптивная бинаризация
+    profiler['cprofile'].enable()
+    try:
+        func()
+    finally:
+        profiler['cprofile'].disable()
+
+    profiler['frames'] += 1
+    profiler['frames_left'] -= 1
+    if profiler['frames_left'] <= 0:
+        stop_profiling()
+
+
+def stop_profiling():
+    """Остановка профилирования и сохранение отчёта"""
+    if not profiler['active']:
+        return
+
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    profiler['active'] = False
+
+    frames = max(1, profiler['frames'])
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    report = io.StringIO()
+
+    # Разбивка по этапам: кадры без изменений пропускают часть этапов,
+    # поэтому время одного вызова считается по числу вызовов этапа
+    total_time = sum(t for t, _, _ in profiler['stages'].values()) or 1.0
+    report.write(f"Кадров: {profiler['frames']}\n\n")
+    report.write(f"{'Этап':<12}{'вызовов':>9}{'мс/вызов':>10}{'мс/кадр':>10}"
+                 f"{'%':>8}{'КБ/вызов':>11}\n")
+    for name, (elapsed, allocated, calls) in profiler['stages'].items():
+        report.write(f"{name:<12}{calls:>9}{elapsed * 1000 / calls:>10.2f}"
+                     f"{elapsed * 1000 / frames:>10.2f}"
+                     f"{elapsed * 100 / total_time:>8.1f}"
+                     f"{allocated / 1024 / calls:>11.1f}\n")
+
+    # Статистика вызовов
+    report.write("\n")
+    stats = pstats.Stats(profiler['cprofile'], stream=report)
+    stats.sort_stats('cumulative').print_stats(20)
+
+    # Рост памяти
+    report.write("Рост памяти (tracemalloc):\n")
+    for diff in snapshot.compare_to(profiler['snapshot'], 'lineno')[:10]:
+        report.write(f"{diff}\n")
+
+    stats_path = os.path.join(output_dir, f"profile_{timestamp}.prof")
+    report_path = os.path.join(output_dir, f"profile_{timestamp}.txt")
+    profiler['cprofile'].dump_stats(stats_path)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+
+    print(report.getvalue())
+    print(f"Отчёт профилирования сохранён в: {os.path.abspath(report_path)}")
+
+
+def find_contours(mask):
+    """Поиск контуров с предварительной фильтрацией компонент связности"""
+    if params['prefilter']:
+        height, width = mask.shape[:2]
+
+        # Отбор компонент одним векторным проходом по статистике
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        _, _, w, h, area = stats[1:].T.astype(np.int64)
+        box = w * h
+        # Площадь любого контура компоненты, включая дыры, не больше площади рамки
+        keep = box >= params['min_area']
+        # Форма и заполненность - отбор с потерями: отбрасывается компонента
+        # целиком вместе с дырами, поэтому по умолчанию эти пороги равны 0
+        keep &= ((area >= params['cc_min_pixels']) &
+                 (np.minimum(w, h) >= params['cc_min_aspect'] * np.maximum(w, h)) &
+                 (area >= params['cc_min_fill'] * box))
+
+        # Дыры (4-связный фон, не касающийся края) заливаются, если их контур
+        # не пройдёт по площади: он идёт по соседним пикселям объекта, поэтому
+        # его площадь не больше (w + 1) * (h + 1). Внешний контур при этом не
+        # меняется, а вложенные в такие дыры компоненты отбрасываются и так
+        _, holes, hole_stats, _ = cv2.connectedComponentsWithStats(
+            (mask == 0).view(np.uint8), connectivity=4)
+        hx, hy, hw, hh, _ = hole_stats[1:].T.astype(np.int64)
+        inner = (hx > 0) & (hy > 0) & (hx + hw < width) & (hy + hh < height)
+        fill = inner & ((hw + 1) * (hh + 1) < params['min_area'])
+
+        mask = (np.r_[False, keep][labels] | np.r_[False, fill][holes]).view(np.uint8)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def build_masks(gray):
+    """Размытие, бинаризация и морфология полутонового изображения"""
+    # 1. Подготовка изображения
+    with stage('blur'):
+        blurred = cv2.GaussianBlur(gray, (params['pre_blur'], params['pre_blur']), 0)
+
+    # 2. Адаптивная бинаризация
+    with stage('threshold'):
         thresh = cv2.adaptiveThreshold(
             blurred, 255,
             cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
@@ -77,37 +271,231 @@ def process_image():
             params['c']
         )
 
-        # 3. Морфологическая обработка
+    # 3. Морфологическая обработка
+    with stage('morphology'):
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,
                                            (params['morph_size'], params['morph_size']))
         morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
         dilated = cv2.dilate(morph, kernel, iterations=params['dilate_iter'])
 
-        # 4. Поиск контуров
-        contours, _ = cv2.findContours(dilated, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return thresh, morph, dilated
+
+
+def select_ellipse(contours):
+    """Первый контур, эллипс которого проходит по площади, форме и углу"""
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < params['min_area'] or len(cnt) < 5:
+            continue
+
+        try:
+            ellipse = cv2.fitEllipse(cnt)
+            (_, _), (ma, MA), angle = ellipse
+            aspect = min(ma, MA) / max(ma, MA)
+
+            if (aspect >= params['aspect_ratio'] and
+                    abs(angle) < params['angle_tolerance']):
+                return ellipse
+
+        except:
+            continue
+
+    return None
+
+
+def detect_ellipse(gray):
+    """Обработка полутонового кадра: маски этапов и найденный эллипс"""
+    thresh, morph, dilated = build_masks(gray)
+
+    # 4. Поиск контуров
+    with stage('contours'):
+        contours = find_contours(dilated)
+
+    # 5. Поиск эллипса
+    with stage('ellipse'):
+        best_ellipse = select_ellipse(contours)
+
+    return {
+        'thresh': thresh,
+        'morph': morph,
+        'dilated': dilated,
+        'ellipse': best_ellipse
+    }
+
+
+def detect_batch(grays):
+    """Поиск эллипсов в пачке одинаковых маленьких изображений одной мозаикой"""
+    height, width = grays[0].shape[:2]
+    for gray in grays:
+        if gray.shape[:2] != (height, width):
+            raise ValueError("Все изображения пачки должны быть одного размера")
+
+    # Общий промежуток между плитками не меньше радиуса ядра морфологии
+    gap = max(1, params['morph_size'] // 2)
+    tile_h, tile_w = height + gap, width + gap
+    if (height * width > batch_max_pixels or
+            tile_h * tile_w > batch_max_overhead * height * width):
+        return [detect_ellipse(gray) for gray in grays]
+
+    cols = int(np.ceil(np.sqrt(len(grays))))
+    rows = int(np.ceil(len(grays) / cols))
+    cores = []
+    for index in range(len(grays)):
+        row, col = divmod(index, cols)
+        top, left = row * tile_h, col * tile_w
+        cores.append((slice(top, top + height), slice(left, left + width)))
+
+    # 1-2. Размытие и бинаризация зависят от границ изображения,
+    # поэтому выполняются для каждого изображения прямо в его плитку
+    thresh = np.zeros((rows * tile_h, cols * tile_w), dtype=np.uint8)
+    with stage('blur'):
+        blurred = [cv2.GaussianBlur(gray, (params['pre_blur'], params['pre_blur']), 0)
+                   for gray in grays]
+    with stage('threshold'):
+        for image, core in zip(blurred, cores):
+            cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                  cv2.THRESH_BINARY_INV, params['block_size'], params['c'],
+                                  dst=thresh[core])
+
+    def fill_gaps(mask, value):
+        # Нейтральное значение в промежутках: 0 для дилатации, 255 для эрозии,
+        # как граница одиночного изображения
+        grid = mask.reshape(rows, tile_h, cols, tile_w)
+        grid[:, height:] = value
+        grid[:, :, :, width:] = value
+        return mask
+
+    # 3. Морфология одним проходом по мозаике, по одной итерации за вызов
+    with stage('morphology'):
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,
+                                           (params['morph_size'], params['morph_size']))
+        morph = thresh
+        for operation, value in ((cv2.dilate, 0), (cv2.dilate, 0),
+                                 (cv2.erode, 255), (cv2.erode, 255)):
+            morph = operation(fill_gaps(morph, value), kernel)
+        dilated = morph
+        for _ in range(params['dilate_iter']):
+            dilated = cv2.dilate(fill_gaps(dilated, 0), kernel)
+        fill_gaps(dilated, 0)
+
+    # 4. Контуры всей мозаики разбираются по плиткам по начальной точке
+    with stage('contours'):
+        contours = [cnt for cnt in find_contours(dilated) if len(cnt) >= 5]
+        tiles = [[] for _ in grays]
+        if contours:
+            starts = np.array([cnt[0, 0] for cnt in contours])
+            indices = (starts[:, 1] // tile_h) * cols + starts[:, 0] // tile_w
+            for cnt, index in zip(contours, indices.tolist()):
+                if index < len(grays):
+                    tiles[index].append(cnt)
+
+    # 5. Поиск эллипса по контурам в координатах исходного изображения:
+    # fitEllipse чувствителен к сдвигу координат, поэтому сдвигаются сами контуры
+    with stage('ellipse'):
+        detections = []
+        for index, core in enumerate(cores):
+            origin = np.array([core[1].start, core[0].start], dtype=np.int32)
+            detections.append({
+                'thresh': thresh[core],
+                'morph': morph[core],
+                'dilated': dilated[core],
+                'ellipse': select_ellipse([cnt - origin for cnt in tiles[index]])
+            })
+
+    return detections
+
+
+def gated_detect(gray, stream=0):
+    """Поиск эллипса с повторным использованием результата для неизменной сцены"""
+    with stage('gate'):
+        thumb = cv2.resize(gray, gate_size, interpolation=cv2.INTER_AREA)
+        last = change_gate.get(stream)
+        if last is not None and last['params'] == params:
+            # Наибольшая разница яркости по клеткам уменьшенного кадра:
+            # среднее по всему кадру скрыло бы небольшой новый объект
+            diff = cv2.norm(thumb, last['thumb'], cv2.NORM_INF)
+            if diff <= params['change_threshold']:
+                return dict(last['detection'], reused=True)
+
+    detection = detect_ellipse(gray)
+    change_gate[stream] = {
+        'thumb': thumb,
+        'params': dict(params),
+        'detection': detection
+    }
+    return dict(detection, reused=False)
+
+
+def compose_view(index, view):
+    """Назначение изображения четверти мозаики; отрисовка - в show_mosaic()"""
+    compositor['sources'][index] = view
+
+
+def draw_quadrant(index, view, size):
+    """Запись изображения в четверть холста без выделения памяти"""
+    width, height = size
+    row, col = divmod(index, 2)
+    quadrant = compositor['canvas'][row * height:(row + 1) * height,
+                                    col * width:(col + 1) * width]
+    scaled = view.shape[1::-1] != size
+
+    if view.ndim == 2:
+        if scaled:
+            view = cv2.resize(view, size, dst=compositor['gray'],
+                              interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(view, cv2.COLOR_GRAY2BGR, dst=quadrant)
+    elif scaled:
+        cv2.resize(view, size, dst=quadrant, interpolation=cv2.INTER_AREA)
+    else:
+        quadrant[:] = view
+
+
+def show_mosaic():
+    """Перерисовка изменившихся четвертей и вывод не чаще display_fps раз в секунду"""
+    now = time.perf_counter()
+    if now - compositor['last_show'] < 1.0 / display_fps:
+        return
 
-        # 5. Поиск эллипса
-        result = global_vars['image'].copy()
-        best_ellipse = None
+    sources = compositor['sources']
+    if sources[0] is None:
+        return
 
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area < params['min_area'] or len(cnt) < 5:
-                continue
+    # Сначала размер холста: при новом холсте перерисовываются все четверти
+    height, width = sources[0].shape[:2]
+    size = (max(1, int(width * display_scale)), max(1, int(height * display_scale)))
+    canvas = compositor['canvas']
+    if canvas is None or canvas.shape[:2] != (size[1] * 2, size[0] * 2):
+        compositor.update({
+            'canvas': np.zeros((size[1] * 2, size[0] * 2, 3), dtype=np.uint8),
+            'gray': np.empty((size[1], size[0]), dtype=np.uint8),
+            'drawn': [None] * 4
+        })
+
+    changed = False
+    for index, view in enumerate(sources):
+        if view is None or compositor['drawn'][index] is view:
+            continue
+        draw_quadrant(index, view, size)
+        compositor['drawn'][index] = view
+        changed = True
 
-            try:
-                ellipse = cv2.fitEllipse(cnt)
-                (_, _), (ma, MA), angle = ellipse
-                aspect = min(ma, MA) / max(ma, MA)
+    if changed:
+        cv2.imshow(window_name, compositor['canvas'])
+        compositor['last_show'] = now
 
-                if (aspect >= params['aspect_ratio'] and
-                        abs(angle) < params['angle_tolerance']):
-                    best_ellipse = ellipse
-                    cv2.ellipse(result, best_ellipse, (0, 255, 0), 2)
-                    break
 
-            except:
-                continue
+def process_image():
+    try:
+        detection = gated_detect(global_vars['gray'])
+        thresh = detection['thresh']
+        morph = detection['morph']
+        dilated = detection['dilated']
+
+        result = global_vars['result']
+        if not detection['reused'] or result is None:
+            result = global_vars['image'].copy()
+            if detection['ellipse'] is not None:
+                cv2.ellipse(result, detection['ellipse'], (0, 255, 0), 2)
 
         # Сохраняем результаты
         global_vars.update({
@@ -118,18 +506,10 @@ def process_image():
         })
 
         # 6. Сборка изображения для отображения
-        display_images = [
-            global_vars['image'],
-            cv2.cvtColor(thresh, cv2.COLOR_GRAY2BGR),
-            cv2.cvtColor(morph, cv2.COLOR_GRAY2BGR),
-            result
-        ]
-
-        top = np.hstack(display_images[:2])
-        bottom = np.hstack(display_images[2:])
-        combined = np.vstack([top, bottom])
-
-        cv2.imshow(window_name, combined)
+        with stage('display'):
+            for index, view in enumerate([global_vars['image'], thresh, morph, result]):
+                compose_view(index, view)
+            show_mosaic()
 
     except Exception as e:
         print(f"Ошибка обработки: {str(e)}")
@@ -161,33 +541,176 @@ def save_results():
     except Exception as e:
         print(f"Ошибка сохранения: {str(e)}")
 
-def main():
+def load_image(path):
+    """Загрузка и предварительная обработка изображения"""
     # Проверка существования файла
-    if not os.path.exists(default_image):
-        print(f"Файл {default_image} не найден!")
-        return
+    if not os.path.exists(path):
+        print(f"Файл {path} не найден!")
+        return None
 
     # Загрузка изображения
-    image = cv2.imread(default_image)
+    image = cv2.imread(path)
     if image is None:
         print("Ошибка чтения файла изображения!")
+        return None
+
+    return cv2.resize(image, (640, 480))
+
+
+def image_identity(path):
+    """Идентификатор входного изображения для сессии"""
+    path = os.path.abspath(path)
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return {'path': path, 'sha1': digest}
+
+
+def record_step():
+    """Запись текущих параметров в хронологию сессии"""
+    steps = session['steps']
+    if steps and steps[-1]['params'] == params:
+        steps[-1]['frames'] += 1
+        return
+
+    if session['start'] is None:
+        session['start'] = time.perf_counter()
+    steps.append({
+        'time': round(time.perf_counter() - session['start'], 3),
+        'frames': 1,
+        'params': dict(params)
+    })
+
+
+def save_session():
+    """Сохранение сессии настройки для последующего воспроизведения"""
+    if not session['steps'] or session['image'] is None:
+        return
+
+    try:
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(output_dir, f"session_{timestamp}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'image': session['image'],
+                'steps': session['steps']
+            }, f, ensure_ascii=False, indent=1)
+
+        print(f"Сессия сохранена в: {os.path.abspath(path)}")
+
+    except Exception as e:
+        print(f"Ошибка сохранения сессии: {str(e)}")
+
+
+def replay_session(path):
+    """Воспроизведение сессии без интерфейса с замером задержки шагов"""
+    with open(path, encoding='utf-8') as f:
+        recorded = json.load(f)
+
+    image_path = recorded['image']['path']
+    image = load_image(image_path)
+    if image is None:
+        return
+    if image_identity(image_path)['sha1'] != recorded['image']['sha1']:
+        print(f"Внимание: файл {image_path} отличается от записанного в сессии")
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    change_gate.clear()
+    total_time = 0.0
+    total_frames = 0
+
+    print(f"{'Шаг':>5}{'кадров':>8}{'повтор':>8}{'первый, мс':>12}{'среднее, мс':>13}")
+    for index, step in enumerate(recorded['steps']):
+        params.update(step['params'])
+        timings = []
+        reused = 0
+        for _ in range(step['frames']):
+            start = time.perf_counter()
+            reused += gated_detect(gray)['reused']
+            timings.append(time.perf_counter() - start)
+
+        total_time += sum(timings)
+        total_frames += len(timings)
+        print(f"{index:>5}{len(timings):>8}{reused:>8}{timings[0] * 1000:>12.2f}"
+              f"{sum(timings) * 1000 / len(timings):>13.3f}")
+
+    print(f"Всего: {total_frames} кадров за {total_time:.3f} с "
+          f"({total_time * 1000 / max(1, total_frames):.3f} мс/кадр)")
+
+
+def run_batch(paths):
+    """Пакетная обработка маленьких изображений мозаиками без интерфейса"""
+    # Группировка по размеру: в мозаику попадают только одинаковые изображения
+    groups = {}
+    for path in paths:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            print(f"Ошибка чтения файла изображения: {path}")
+            continue
+        groups.setdefault(gray.shape, []).append((path, gray))
+
+    start = time.perf_counter()
+    count = 0
+    for items in groups.values():
+        for offset in range(0, len(items), batch_size):
+            chunk = items[offset:offset + batch_size]
+            detections = detect_batch([gray for _, gray in chunk])
+            for (path, _), detection in zip(chunk, detections):
+                print(f"{path}: {detection['ellipse']}")
+            count += len(chunk)
+
+    total = time.perf_counter() - start
+    print(f"Обработано изображений: {count} за {total:.3f} с "
+          f"({count / max(total, 1e-9):.1f} изобр./с)")
+
+
+def parse_args():
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description=window_name)
+    parser.add_argument('--profile', type=int, metavar='N', default=0,
+                        help="профилировать первые N кадров (cProfile + tracemalloc)")
+    parser.add_argument('--image', default=default_image,
+                        help="входное изображение")
+    parser.add_argument('--replay', metavar='SESSION',
+                        help="воспроизвести записанную сессию без интерфейса")
+    parser.add_argument('--batch', nargs='+', metavar='IMAGE',
+                        help="пакетная обработка маленьких изображений без интерфейса")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.replay:
+        replay_session(args.replay)
+        return
+
+    if args.batch:
+        run_batch(args.batch)
+        return
+
+    image = load_image(args.image)
+    if image is None:
         return
 
-    # Предварительная обработка
-    image = cv2.resize(image, (640, 480))
     global_vars['image'] = image
     global_vars['gray'] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Идентификатор фиксируется при загрузке: файл может измениться до выхода
+    session['image'] = image_identity(args.image)
 
     # Создание интерфейса
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
     cv2.resizeWindow(window_name, 1280, 720)
     initialize_trackbars()
 
+    if args.profile > 0:
+        start_profiling(args.profile)
+
     # Основной цикл
     while True:
         try:
             update_parameters()
-            process_image()
+            record_step()
+            profile_frame(process_image)
 
             key = cv2.waitKey(1) & 0xFF
 
@@ -195,6 +718,13 @@ def main():
             if key == ord('s'):
                 save_results()
 
+            # Профилирование по клавише 'P'
+            elif key == ord('p'):
+                if profiler['active']:
+                    stop_profiling()
+                else:
+                    start_profiling(profile_frames)
+
             # Выход по ESC
             elif key == 27:
                 break
@@ -202,6 +732,8 @@ def main():
         except KeyboardInterrupt:
             break
 
+    stop_profiling()
+    save_session()
     cv2.destroyAllWindows()
 
 
@@ -0,0 +1,229 @@
+import argparse
+import multiprocessing as mp
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from main import default_image, gated_detect, params
+
+# ========== НАСТРОЙКИ ==========
+frame_size = (640, 480)  # Размер кадра в буфере (ширина, высота)
+slots_per_worker = 4  # Слотов кольцевого буфера на один обработчик
+# ===============================
+
+
+class FrameRing:
+    """Кольцевой буфер кадров в разделяемой памяти"""
+
+    def __init__(self, slots, shape, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        size = slots * int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+
+    def handle(self):
+        """Аргументы для подключения к буферу из другого процесса"""
+        return self.slots, self.shape, self.shm.name
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def open_source(source, frames):
+    """Генератор кадров из камеры, видеофайла или изображения"""
+    if source.isdigit():
+        capture = cv2.VideoCapture(int(source))
+    else:
+        image = cv2.imread(source)
+        if image is not None:
+            # Статичное изображение повторяется как видеопоток
+            count = 0
+            while not frames or count < frames:
+                yield image
+                count += 1
+            return
+        capture = cv2.VideoCapture(source)
+
+    try:
+        count = 0
+        while not frames or count < frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+            count += 1
+    finally:
+        capture.release()
+
+
+def to_bgr(frame):
+    """Приведение кадра к 3-канальному uint8, как у слотов буфера"""
+    if frame.dtype != np.uint8:
+        raise ValueError(f"Неподдерживаемый тип кадра: {frame.dtype}")
+    if frame.ndim == 2 or frame.shape[2] == 1:
+        return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    if frame.shape[2] == 4:
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    return frame
+
+
+def capture_worker(source, camera, ring_handle, free, ready, counter, frames):
+    """Процесс захвата: запись кадров в свободные слоты буфера"""
+    ring = FrameRing(*ring_handle)
+    try:
+        for frame in open_source(source, frames):
+            # Иначе resize молча выделит новый dst вместо записи в слот
+            frame = to_bgr(frame)
+            slot = free.get()
+            cv2.resize(frame, frame_size, dst=ring.frames[slot])
+
+            with counter.get_lock():
+                seq = counter.value
+                counter.value += 1
+            ready.put((seq, camera, slot))
+    finally:
+        ring.close()
+
+
+def detect_worker(ring_handle, settings, ready, free, results):
+    """Процесс обработки: чтение кадра из слота без копирования и поиск эллипса"""
+    ring = None
+    try:
+        params.update(settings)
+        cv2.setNumThreads(1)  # Параллелизм обеспечивается процессами
+        ring = FrameRing(*ring_handle)
+
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+
+            seq, camera, slot = item
+            start = time.perf_counter()
+            gray = cv2.cvtColor(ring.frames[slot], cv2.COLOR_BGR2GRAY)
+            free.put(slot)  # Слот больше не нужен, кадр уже в gray
+
+            detection = gated_detect(gray, camera)
+            results.put((seq, camera, detection['ellipse'], detection['reused'],
+                         time.perf_counter() - start))
+    finally:
+        # Сигнал завершения отправляется всегда, иначе gather() будет ждать вечно
+        if ring is not None:
+            ring.close()
+        results.put(None)
+
+
+def gather(results, workers):
+    """Выдача результатов в порядке номеров кадров"""
+    pending = {}
+    next_seq = 0
+    finished = 0
+
+    while finished < workers:
+        item = results.get()
+        if item is None:
+            finished += 1
+            continue
+
+        pending[item[0]] = item
+        while next_seq in pending:
+            yield pending.pop(next_seq)
+            next_seq += 1
+
+    for seq in sorted(pending):
+        yield pending[seq]
+
+
+def run_pipeline(sources, workers, frames=0):
+    """Многопроцессный конвейер захват -> обработка через общий буфер"""
+    width, height = frame_size
+    ring = FrameRing(workers * slots_per_worker, (height, width, 3))
+
+    free = mp.Queue()
+    ready = mp.Queue()
+    results = mp.Queue()
+    counter = mp.Value('q', 0)
+    for slot in range(ring.slots):
+        free.put(slot)
+
+    captures = [
+        mp.Process(target=capture_worker,
+                   args=(source, camera, ring.handle(), free, ready, counter, frames),
+                   daemon=True)
+        for camera, source in enumerate(sources)
+    ]
+    detectors = [
+        mp.Process(target=detect_worker,
+                   args=(ring.handle(), dict(params), ready, free, results),
+                   daemon=True)
+        for _ in range(workers)
+    ]
+
+    def finish_capture():
+        # После окончания захвата каждому обработчику отправляется сигнал остановки
+        for process in captures:
+            process.join()
+        for _ in detectors:
+            ready.put(None)
+
+    try:
+        for process in captures + detectors:
+            process.start()
+        threading.Thread(target=finish_capture, daemon=True).start()
+
+        yield from gather(results, workers)
+
+        for process in detectors:
+            process.join()
+    finally:
+        for process in captures + detectors:
+            if process.is_alive():
+                process.terminate()
+        ring.close()
+        ring.unlink()
+
+
+def parse_args():
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Многопроцессный поиск эллипсов")
+    parser.add_argument('sources', nargs='*', default=[default_image],
+                        help="индексы камер, видеофайлы или изображения")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="число процессов обработки")
+    parser.add_argument('--frames', type=int, default=0,
+                        help="ограничение кадров на источник (0 - без ограничения)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.frames and not all(s.isdigit() for s in args.sources):
+        # Изображения повторяются бесконечно, поэтому нужен предел
+        args.frames = 100
+
+    start = time.perf_counter()
+    count = 0
+    try:
+        for seq, camera, ellipse, reused, elapsed in run_pipeline(args.sources, max(1, args.workers),
+                                                                  args.frames):
+            count += 1
+            status = "повтор" if reused else f"{elapsed * 1000:.1f} мс"
+            print(f"#{seq} камера {camera}: {ellipse} ({status})")
+    except KeyboardInterrupt:
+        pass
+
+    total = time.perf_counter() - start
+    print(f"Обработано кадров: {count} за {total:.2f} с ({count / max(total, 1e-9):.1f} к/с)")
+
+
+if __name__ == "__main__":
+    main()